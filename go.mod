@@ -1,7 +1,3 @@
 module github.com/vmikk/goclust
 
 go 1.22.1
-
-require (
-	github.com/pbnjay/clustering v0.0.0-20180426023255-34a8f36cd397 // indirect
-)
@@ -2,15 +2,14 @@ package main
 
 import (
 	"bufio"
+	"bytes"
 	"flag"
-	"fmt"
 	"log"
+	"math"
 	"os"
+	"runtime"
 	"sort"
 	"strconv"
-	"strings"
-
-	"github.com/pbnjay/clustering"
 )
 
 // clusterInfo holds information about a single cluster member
@@ -19,164 +18,699 @@ type clusterInfo struct {
 	ClusterID int
 }
 
+// edgeList holds the pairwise distances that passed the cutoff,
+// with labels interned to sequential integer IDs
+type edgeList struct {
+	Labels   []string  // Label of each ID
+	A, B     []int32   // IDs of the two labels in each pair
+	Distance []float64 // Distance of each pair
+}
+
 // There are two clustering functions - `getSingleLinkageClusters` and `getCompleteLinkageClusters`
 // They read pairwise distances from the input file,
 // form clusters based on the cutoff distance,
 // and return cluster members and their IDs
 
-// Single linkage clustering
-func getSingleLinkageClusters(inputPath string, cutOff float64, includeEqual bool) ([]clusterInfo, error) {
-	clustersID := make(map[string]int)
-	clusterMembers := make(map[int]map[string]bool)
-	labelsSet := make(map[string]bool)
+// Size of the buffers for reading the input and writing the output
+const ioBufferSize = 1 << 20
 
-	numClusters := 0
+// Create a line scanner with a large read buffer
+func newLineScanner(file *os.File) *bufio.Scanner {
+	scanner := bufio.NewScanner(file)
+	scanner.Buffer(make([]byte, ioBufferSize), ioBufferSize)
+	return scanner
+}
+
+// Split a line of the input into the first three whitespace-separated fields
+// (two labels and their distance), without allocating new strings
+// The returned slices are only valid until the next scan
+func splitLine(line []byte) (label1, label2, distance []byte, ok bool) {
+	// Fast path for the tab-separated lines written by `usearch -calc_distmx -tabbedout`:
+	// the tabs are located with `bytes.IndexByte` (vectorized), and only the distance field is scanned
+	// It is taken only if both labels are free of other whitespace, so the fields are the same as below
+	if tab1 := bytes.IndexByte(line, '\t'); tab1 > 0 && !hasSpace(line[:tab1]) {
+		rest := line[tab1+1:]
+		if tab2 := bytes.IndexByte(rest, '\t'); tab2 > 0 && !hasSpace(rest[:tab2]) {
+			distance = rest[tab2+1:]
+			end := 0
+			for end < len(distance) && !isSpace(distance[end]) {
+				end++
+			}
+			if end > 0 {
+				return line[:tab1], rest[:tab2], distance[:end], true
+			}
+		}
+	}
+
+	var fields [3][]byte
+	numFields := 0
+	for i := 0; i < len(line) && numFields < 3; {
+		for i < len(line) && isSpace(line[i]) {
+			i++
+		}
+		start := i
+		for i < len(line) && !isSpace(line[i]) {
+			i++
+		}
+		if i > start {
+			fields[numFields] = line[start:i]
+			numFields++
+		}
+	}
+	if numFields < 3 {
+		return nil, nil, nil, false
+	}
+	return fields[0], fields[1], fields[2], true
+}
+
+func isSpace(c byte) bool {
+	return c == '\t' || c == ' ' || c == '\r' || c == '\n' || c == '\v' || c == '\f'
+}
+
+// Check whether a field contains whitespace (all whitespace characters are at most ' ')
+func hasSpace(field []byte) bool {
+	for _, c := range field {
+		if c <= ' ' && isSpace(c) {
+			return true
+		}
+	}
+	return false
+}
+
+// Powers of ten that are exactly representable as float64
+var exactPowersOfTen = [...]float64{1e0, 1e1, 1e2, 1e3, 1e4, 1e5, 1e6, 1e7, 1e8, 1e9, 1e10, 1e11, 1e12, 1e13, 1e14, 1e15, 1e16, 1e17, 1e18, 1e19, 1e20, 1e21, 1e22}
+
+// Parse a distance field
+// Plain decimals with up to 15 significant digits (such as `0.0123`) are parsed directly:
+// both the digits and the power of ten are exact float64 values, so a single division
+// gives the correctly rounded result, the same as `strconv.ParseFloat`
+// Anything else (signs, exponents, longer numbers, invalid input) is passed to `strconv.ParseFloat`
+func parseDistance(field []byte) (float64, error) {
+	var mantissa uint64
+	numDigits, numDecimals := 0, 0
+	seenDot := false
+	for _, c := range field {
+		switch {
+		case c >= '0' && c <= '9':
+			mantissa = mantissa*10 + uint64(c-'0')
+			if mantissa > 0 {
+				numDigits++
+			}
+			if seenDot {
+				numDecimals++
+			}
+		case c == '.' && !seenDot:
+			seenDot = true
+		default:
+			return strconv.ParseFloat(string(field), 64)
+		}
+	}
+	if numDigits > 15 || numDecimals >= len(exactPowersOfTen) || len(field) == 0 || seenDot && len(field) == 1 {
+		return strconv.ParseFloat(string(field), 64)
+	}
+	return float64(mantissa) / exactPowersOfTen[numDecimals], nil
+}
+
+// Number of pairs passed to the batch function of `readEdges` at once
+const edgeBatchSize = 1 << 16
+
+// Read the pairwise distances that pass the cutoff from the input file
+// Labels are assigned IDs in the order of their first appearance,
+// either in any pair (if `allLabels` is set) or in a retained pair only
+// If `batch` is set, it is called with the edge list after every `edgeBatchSize` pairs
+// and after the last one, and the pairs are dropped from the list after each call (the labels are kept),
+// so that the pairs are not held in memory all at once
+func readEdges(inputPath string, cutOff float64, includeEqual, allLabels bool, batch func(edges *edgeList)) (*edgeList, error) {
 	file, err := os.Open(inputPath)
 	if err != nil {
 		return nil, err
 	}
 	defer file.Close()
 
-	scanner := bufio.NewScanner(file)
+	edges := &edgeList{}
+	labelToID := make(map[string]int32)
+
+	// Get the integer ID of a label, assigning a new one on first sight
+	intern := func(label []byte) int32 {
+		id, ok := labelToID[string(label)]
+		if !ok {
+			id = int32(len(edges.Labels))
+			labelToID[string(label)] = id
+			edges.Labels = append(edges.Labels, string(label))
+		}
+		return id
+	}
+
+	scanner := newLineScanner(file)
 	for scanner.Scan() {
-		line := scanner.Text()
-		parts := strings.Fields(line)
-		if len(parts) < 3 {
+		label1, label2, distanceStr, ok := splitLine(scanner.Bytes())
+		if !ok {
 			continue // Skip lines that don't have enough parts
 		}
-		label1, label2, distanceStr := parts[0], parts[1], parts[2]
 
-		labelsSet[label1] = true
-		labelsSet[label2] = true
+		var id1, id2 int32
+		if allLabels {
+			id1, id2 = intern(label1), intern(label2)
+		}
 
-		distance, err := strconv.ParseFloat(distanceStr, 64)
+		distance, err := parseDistance(distanceStr)
 		if err != nil {
 			return nil, err
 		}
 
-		// Comparison with the cutoff depends on the `--includeequal` flag
-		if includeEqual && distance > cutOff || !includeEqual && distance >= cutOff {
+		if !withinCutoff(distance, cutOff, includeEqual) {
 			continue
 		}
 
-		in1, ok1 := clustersID[label1]
-		in2, ok2 := clustersID[label2]
+		if !allLabels {
+			id1, id2 = intern(label1), intern(label2)
+		}
+		edges.A = append(edges.A, id1)
+		edges.B = append(edges.B, id2)
+		edges.Distance = append(edges.Distance, distance)
+		if batch != nil && len(edges.A) == edgeBatchSize {
+			batch(edges)
+			edges.A, edges.B, edges.Distance = edges.A[:0], edges.B[:0], edges.Distance[:0]
+		}
+	}
+	if err := scanner.Err(); err != nil {
+		return nil, err
+	}
+	if batch != nil && len(edges.A) > 0 {
+		batch(edges)
+		edges.A, edges.B, edges.Distance = edges.A[:0], edges.B[:0], edges.Distance[:0]
+	}
 
-		if !ok1 && !ok2 {
-			clusterID := numClusters
-			clustersID[label1] = clusterID
-			clustersID[label2] = clusterID
-			clusterMembers[clusterID] = map[string]bool{label1: true, label2: true}
-			numClusters++
-		} else if ok1 && !ok2 {
-			clustersID[label2] = in1
-			clusterMembers[in1][label2] = true
-		} else if !ok1 && ok2 {
-			clustersID[label1] = in2
-			clusterMembers[in2][label1] = true
-		} else if in1 != in2 {
-			for label := range clusterMembers[in2] {
-				clustersID[label] = in1
-				clusterMembers[in1][label] = true
-			}
-			delete(clusterMembers, in2)
+	return edges, nil
+}
+
+// Remove self-pairs and duplicate pairs (in either order) from the edge list in place,
+// keeping the smallest distance of each pair
+// Pairs are stored with the smaller ID in `A`, in order of their first appearance
+func dedupEdges(edges *edgeList) {
+	index := make(map[uint64]int, len(edges.A)/2) // Position of each pair in the deduplicated list
+	n := 0
+	for i, id1 := range edges.A {
+		id2, distance := edges.B[i], edges.Distance[i]
+		if id1 == id2 {
+			continue
+		}
+		key := pairKey(id1, id2)
+		if j, ok := index[key]; ok {
+			edges.Distance[j] = min(edges.Distance[j], distance)
+			continue
 		}
+		index[key] = n
+		edges.A[n], edges.B[n], edges.Distance[n] = min(id1, id2), max(id1, id2), distance
+		n++
 	}
+	edges.A, edges.B, edges.Distance = edges.A[:n], edges.B[:n], edges.Distance[:n]
+}
 
-	// Reassign cluster IDs to be zero-based and sequential
-	sequentialClusters := reassignClusterIDs(clustersID)
+// Single linkage clustering
+// Clusters are tracked with a disjoint-set forest (union-find) over integer IDs,
+// so merging two clusters does not require relabeling their members
+// The pairs are merged in batches while reading, so memory grows with the number of labels only
+func getSingleLinkageClusters(inputPath string, cutOff float64, includeEqual bool) ([]clusterInfo, error) {
+	var parent []int32
+	var rank []uint8
+	edges, err := readEdges(inputPath, cutOff, includeEqual, false, func(edges *edgeList) {
+		// Labels first seen in this batch start as singleton sets
+		for id := len(parent); id < len(edges.Labels); id++ {
+			parent = append(parent, int32(id))
+			rank = append(rank, 0)
+		}
+		slinkCore(edges.A, edges.B, parent, rank)
+	})
+	if err != nil {
+		return nil, err
+	}
 
-	return sequentialClusters, nil
+	return assignClusterIDs(edges.Labels, parent, nil), nil
 }
 
-// Function to reassign cluster IDs sequentially
-func reassignClusterIDs(clustersID map[string]int) []clusterInfo {
-	newID := 0
-	oldToNewID := make(map[int]int)
-	var clusters []clusterInfo
+// Get the cluster of each label from the disjoint-set forest,
+// with roots renumbered to zero-based and sequential cluster IDs
+// Only the labels with `keep[id]` set are reported, unless `keep` is nil
+func assignClusterIDs(labels []string, parent []int32, keep []bool) []clusterInfo {
+	rootToCluster := make([]int, len(labels))
+	for i := range rootToCluster {
+		rootToCluster[i] = -1
+	}
+	numClusters := 0
+	clusters := make([]clusterInfo, 0, len(labels))
+	for id, label := range labels {
+		if keep != nil && !keep[id] {
+			continue
+		}
+		root := find(parent, int32(id))
+		if rootToCluster[root] < 0 {
+			rootToCluster[root] = numClusters
+			numClusters++
+		}
+		clusters = append(clusters, clusterInfo{Label: label, ClusterID: rootToCluster[root]})
+	}
+	return clusters
+}
 
-	for label, oldID := range clustersID {
-		if _, exists := oldToNewID[oldID]; !exists {
-			oldToNewID[oldID] = newID
-			newID++
+// Create a disjoint-set forest of `n` singleton sets
+// The ranks for union by rank are allocated separately (`make([]uint8, n)`), as not every user needs them:
+// a rank never exceeds log2(n), so ranks are stored as bytes
+func newDisjointSets(n int) []int32 {
+	parent := make([]int32, n)
+	for i := range parent {
+		parent[i] = int32(i)
+	}
+	return parent
+}
+
+// Merge the two sets of every pair `a[i]`, `b[i]` in the disjoint-set forest
+// This is the hot loop for large inputs: `union` is too large for the compiler to inline,
+// so its body is repeated here to keep the loop free of function calls
+// (`find` is inlined), and `b` is resliced so that its bounds check is eliminated
+func slinkCore(a, b []int32, parent []int32, rank []uint8) {
+	b = b[:len(a)]
+	for i, id1 := range a {
+		root1 := find(parent, id1)
+		root2 := find(parent, b[i])
+		if root1 == root2 {
+			continue
+		}
+		if rank[root1] < rank[root2] {
+			root1, root2 = root2, root1
+		}
+		parent[root2] = root1
+		if rank[root1] == rank[root2] {
+			rank[root1]++
 		}
-		clusters = append(clusters, clusterInfo{Label: label, ClusterID: oldToNewID[oldID]})
 	}
+}
 
-	return clusters
+// Merge the sets containing `id1` and `id2` in the disjoint-set forest
+// Returns false if they already were in the same set
+func union(parent []int32, rank []uint8, id1, id2 int32) bool {
+	root1 := find(parent, id1)
+	root2 := find(parent, id2)
+	if root1 == root2 {
+		return false
+	}
+
+	// Union by rank: attach the shorter tree under the taller one
+	if rank[root1] < rank[root2] {
+		root1, root2 = root2, root1
+	}
+	parent[root2] = root1
+	if rank[root1] == rank[root2] {
+		rank[root1]++
+	}
+	return true
+}
+
+// Find the root of the set containing `x`, using path halving
+// (every visited node is re-pointed to its grandparent)
+// Unlike full path compression, this needs a single pass and no recursion,
+// and the function is small enough to be inlined into its callers
+func find(parent []int32, x int32) int32 {
+	for parent[x] != x {
+		parent[x] = parent[parent[x]]
+		x = parent[x]
+	}
+	return x
+}
+
+// Distance assumed for pairs that are missing from the sparse input
+const maxDistance = 1.0
+
+// Check whether a distance passes the cutoff
+// Comparison with the cutoff depends on the `--includeequal` flag
+func withinCutoff(distance, cutOff float64, includeEqual bool) bool {
+	if includeEqual {
+		return distance <= cutOff
+	}
+	return distance < cutOff
 }
 
 // Complete linkage clustering
-func getCompleteLinkageClusters(inputPath string, cutOff float64) ([]clusterInfo, error) {
-	file, err := os.Open(inputPath)
+// Uses the nearest-neighbor chain algorithm: a chain of clusters is extended
+// by the nearest neighbor of its last cluster until two clusters are reciprocal
+// nearest neighbors, and these two are merged. Complete linkage is reducible,
+// so the merges are the same as with repeatedly merging the globally closest pair
+// Pairs missing from the input are at `maxDistance`. If that distance fails the cutoff,
+// only the distances that pass it are stored, and a pair of clusters with any missing
+// member pair is never merged. Otherwise, the pairs above the cutoff are kept as well,
+// as they are the only ones that can keep two clusters apart
+func getCompleteLinkageClusters(inputPath string, cutOff float64, includeEqual bool) ([]clusterInfo, error) {
+	missingWithinCutoff := withinCutoff(maxDistance, cutOff, includeEqual)
+	readCutOff, readIncludeEqual := cutOff, includeEqual
+	if missingWithinCutoff {
+		readCutOff, readIncludeEqual = math.Inf(1), true
+	}
+	edges, err := readEdges(inputPath, readCutOff, readIncludeEqual, true, nil)
 	if err != nil {
 		return nil, err
 	}
-	defer file.Close()
+	labels := edges.Labels
 
-	distances := make(clustering.DistanceMap)
-	labels := make(map[string]bool) // Track all unique labels
-	scanner := bufio.NewScanner(file)
+	// If both the missing and all stored pairs pass the cutoff, every pair of clusters eventually does
+	if missingWithinCutoff && allWithinCutoff(edges, cutOff, includeEqual) {
+		result := make([]clusterInfo, len(labels))
+		for i, label := range labels {
+			result[i] = clusterInfo{Label: label, ClusterID: 0}
+		}
+		return result, nil
+	}
 
-	// First pass: collect all labels
-	for scanner.Scan() {
-		line := scanner.Text()
-		parts := strings.Fields(line)
-		if len(parts) < 3 {
-			continue
+	dedupEdges(edges)
+	parent := newDisjointSets(len(labels)) // Cluster each cluster was merged into (itself while active)
+	if !missingWithinCutoff {
+		mergeCompleteLinkageChain(parent, edges.A, edges.B, edges.Distance)
+		return assignClusterIDs(labels, parent, nil), nil
+	}
+
+	// Clusters closer than `maxDistance` are merged first, using only the pairs below it
+	// (missing pairs are not closer), and the remaining clusters, which are all
+	// at `maxDistance` or more from each other, are merged next
+	var a, b []int32
+	var distance []float64
+	for i, d := range edges.Distance {
+		if d < maxDistance {
+			a, b, distance = append(a, edges.A[i]), append(b, edges.B[i]), append(distance, d)
+		}
+	}
+	mergeCompleteLinkageChain(parent, a, b, distance)
+	mergeCompleteLinkageAboveMaxDistance(parent, edges, cutOff, includeEqual)
+
+	return assignClusterIDs(labels, parent, nil), nil
+}
+
+// Check whether the distances of all pairs of different labels pass the cutoff
+func allWithinCutoff(edges *edgeList, cutOff float64, includeEqual bool) bool {
+	for i, distance := range edges.Distance {
+		if edges.A[i] != edges.B[i] && !withinCutoff(distance, cutOff, includeEqual) {
+			return false
 		}
-		labels[parts[0]] = true
-		labels[parts[1]] = true
 	}
+	return true
+}
 
-	// Initialize maximum distances
-	for label1 := range labels {
-		distMap := make(map[clustering.ClusterItem]float64)
-		for label2 := range labels {
-			if label1 != label2 { // Do not set distance to self
-				distMap[clustering.ClusterItem(label2)] = 1.0 // Use 1.0 as the max distance
+// Merge the clusters of the disjoint-set forest `parent` with the nearest-neighbor chain algorithm,
+// given the unique pairs of clusters `a[i]`, `b[i]` that can be merged and their distances
+// A pair of clusters is merged only if all pairs of their members are given
+func mergeCompleteLinkageChain(parent []int32, a, b []int32, distance []float64) {
+	distances := make(map[uint64]float64, len(a))              // Distances between clusters, keyed by `pairKey`
+	neighbors := newNeighborLists(len(parent), a, b, distance) // Clusters that may still be merged with each cluster
+	for i, d := range distance {
+		distances[pairKey(a[i], b[i])] = d
+	}
+
+	var chain []int32
+	for i := range parent {
+		start := int32(i)
+		// A cluster without neighbors can not be merged any more,
+		// as complete linkage distances never decrease
+		for parent[start] == start && neighbors.End[start] > neighbors.Start[start] {
+			chain = append(chain[:0], start)
+			for len(chain) > 0 {
+				last := chain[len(chain)-1]
+
+				// Find the nearest neighbor of the last cluster in the chain,
+				// preferring the previous cluster in the chain on ties (to avoid cycles)
+				// and the smallest ID otherwise
+				previous := int32(-1)
+				if len(chain) > 1 {
+					previous = chain[len(chain)-2]
+				}
+				// The scan reads the distances stored next to the neighbor IDs; the map is only
+				// consulted for neighbors that were merged with another cluster since the entry was written
+				// Neighbors merged away or whose distance has been dropped are removed from the list here
+				nearest, nearestDist := int32(-1), math.Inf(1)
+				numCurrent := neighbors.Start[last]
+				for k := neighbors.Start[last]; k < neighbors.End[last]; k++ {
+					other, distance := neighbors.IDs[k], neighbors.Distance[k]
+					if parent[other] != other {
+						continue
+					}
+					if neighbors.Stamp[k] < neighbors.Updated[other] {
+						var ok bool
+						if distance, ok = distances[pairKey(last, other)]; !ok {
+							continue
+						}
+					}
+					neighbors.IDs[numCurrent], neighbors.Distance[numCurrent], neighbors.Stamp[numCurrent] = other, distance, neighbors.Clock
+					numCurrent++
+					if distance < nearestDist || distance == nearestDist && nearest != previous && (other == previous || other < nearest) {
+						nearest, nearestDist = other, distance
+					}
+				}
+				neighbors.End[last] = numCurrent
+				if numCurrent == neighbors.Start[last] {
+					chain = chain[:len(chain)-1]
+					continue
+				}
+
+				if nearest != previous {
+					chain = append(chain, nearest)
+					continue
+				}
+
+				// Reciprocal nearest neighbors, merge them into the cluster with the smaller ID
+				chain = chain[:len(chain)-2]
+				kept, removed := min(last, previous), max(last, previous)
+				mergeCompleteLinkage(distances, neighbors, kept, removed)
+				parent[removed] = kept
 			}
 		}
-		distances[label1] = distMap
 	}
+}
 
-	// Second pass: set actual distances from file
-	file.Seek(0, 0) // Reset file pointer to beginning
-	scanner = bufio.NewScanner(file)
-	for scanner.Scan() {
-		line := scanner.Text()
-		parts := strings.Fields(line)
-		if len(parts) < 3 {
+// Continue merging the clusters of the disjoint-set forest `parent` when missing pairs pass the cutoff,
+// after all clusters closer than `maxDistance` have been merged
+// The distance between two clusters is then `maxDistance`, unless some pair of their members
+// is further apart, so only these larger distances are stored (the lists of stored distances
+// only grow with merges). The nearest neighbor of a cluster is the cluster with the smallest ID
+// that has no stored distance to it, or the nearest stored one if there is no such cluster
+func mergeCompleteLinkageAboveMaxDistance(parent []int32, edges *edgeList, cutOff float64, includeEqual bool) {
+	distances := make(map[uint64]float64)  // Distances above `maxDistance` between clusters, keyed by `pairKey`
+	stored := make([][]int32, len(parent)) // Clusters with a stored distance to each cluster
+	for i, distance := range edges.Distance {
+		if distance <= maxDistance {
+			continue
+		}
+		id1, id2 := find(parent, edges.A[i]), find(parent, edges.B[i])
+		key := pairKey(id1, id2)
+		if known, ok := distances[key]; ok {
+			distances[key] = max(known, distance)
 			continue
 		}
-		distance, _ := strconv.ParseFloat(parts[2], 64)
-		distances[parts[0]][clustering.ClusterItem(parts[1])] = distance
-		distances[parts[1]][clustering.ClusterItem(parts[0])] = distance
+		distances[key] = distance
+		stored[id1] = append(stored[id1], id2)
+		stored[id2] = append(stored[id2], id1)
 	}
 
-	clusters := clustering.NewDistanceMapClusterSet(distances)
-	clustering.Cluster(clusters, clustering.Threshold(cutOff), clustering.CompleteLinkage())
+	// Active clusters in order of their IDs (doubly linked list, ending at `len(parent)`)
+	// A removed cluster keeps its link to the next cluster, which leads to the next active one
+	numClusters := int32(len(parent))
+	next, prev := make([]int32, numClusters), make([]int32, numClusters)
+	for id := range parent {
+		next[id], prev[id] = int32(id+1), int32(id-1)
+	}
+	unlink := func(id int32) {
+		if prev[id] >= 0 {
+			next[prev[id]] = next[id]
+		}
+		if next[id] < numClusters {
+			prev[next[id]] = prev[id]
+		}
+	}
+	for i := range parent {
+		if id := int32(i); parent[id] != id {
+			unlink(id)
+		}
+	}
 
-	var result []clusterInfo
-	clusterIDMap := make(map[int]int)
-	currentClusterID := 0
+	// No active cluster with a smaller ID than `cursor[id]` is at `maxDistance` from cluster `id`
+	// As clusters are only removed and stored distances only added, the scans can resume from there
+	cursor := make([]int32, len(parent))
 
-	clusters.EachCluster(-1, func(cluster int) {
-		clusters.EachItem(cluster, func(item clustering.ClusterItem) {
-			label, ok := item.(string)
-			if !ok {
-				log.Printf("Type assertion failed for item: %+v", item)
-				return
+	// Find the nearest neighbor of a cluster, preferring the previous cluster in the chain on ties
+	// and the smallest ID otherwise. Returns -1 if no neighbor passes the cutoff
+	nearestNeighbor := func(last, previous int32) int32 {
+		if previous >= 0 {
+			if _, ok := distances[pairKey(last, previous)]; !ok {
+				return previous
 			}
-			if _, exists := clusterIDMap[cluster]; !exists {
-				clusterIDMap[cluster] = currentClusterID
-				currentClusterID++
+		}
+		for other := cursor[last]; other < numClusters; other = next[other] {
+			if parent[other] != other {
+				continue // Removed clusters lead to the next active one
 			}
-			result = append(result, clusterInfo{Label: label, ClusterID: clusterIDMap[cluster]})
-		})
-	})
+			if _, ok := distances[pairKey(last, other)]; other != last && !ok {
+				cursor[last] = other
+				return other
+			}
+		}
+		cursor[last] = numClusters
+		nearest, nearestDist := int32(-1), math.Inf(1)
+		numCurrent := 0
+		for _, other := range stored[last] {
+			if parent[other] != other {
+				continue // Merged away
+			}
+			stored[last][numCurrent] = other
+			numCurrent++
+			distance := distances[pairKey(last, other)]
+			if !withinCutoff(distance, cutOff, includeEqual) {
+				continue
+			}
+			if distance < nearestDist || distance == nearestDist && nearest != previous && (other == previous || other < nearest) {
+				nearest, nearestDist = other, distance
+			}
+		}
+		stored[last] = stored[last][:numCurrent]
+		return nearest
+	}
 
-	return result, nil
+	var chain []int32
+	for i := range parent {
+		start := int32(i)
+		for parent[start] == start && nearestNeighbor(start, -1) >= 0 {
+			chain = append(chain[:0], start)
+			for len(chain) > 0 {
+				last := chain[len(chain)-1]
+				previous := int32(-1)
+				if len(chain) > 1 {
+					previous = chain[len(chain)-2]
+				}
+				nearest := nearestNeighbor(last, previous)
+				if nearest < 0 {
+					chain = chain[:len(chain)-1]
+					continue
+				}
+				if nearest != previous {
+					chain = append(chain, nearest)
+					continue
+				}
+
+				// Reciprocal nearest neighbors, merge them into the cluster with the smaller ID:
+				// d(kept+removed, other) = max(d(kept, other), d(removed, other)),
+				// which is only stored if either of the two distances is
+				chain = chain[:len(chain)-2]
+				kept, removed := min(last, previous), max(last, previous)
+				delete(distances, pairKey(kept, removed))
+				for _, other := range stored[removed] {
+					removedKey := pairKey(removed, other)
+					distance, ok := distances[removedKey]
+					if !ok || parent[other] != other {
+						continue
+					}
+					delete(distances, removedKey)
+					keptKey := pairKey(kept, other)
+					if known, ok := distances[keptKey]; ok {
+						distances[keptKey] = max(known, distance)
+						continue
+					}
+					distances[keptKey] = distance
+					stored[kept] = append(stored[kept], other)
+					stored[other] = append(stored[other], kept)
+				}
+				stored[removed] = nil
+				parent[removed] = kept
+				cursor[kept] = max(cursor[kept], cursor[removed])
+				unlink(removed)
+			}
+		}
+	}
+}
+
+// Merge cluster `removed` into cluster `kept`, updating the distances to all other clusters
+// with the Lance-Williams recurrence for complete linkage:
+// d(kept+removed, other) = max(d(kept, other), d(removed, other)),
+// which is missing if either of the two distances is missing
+func mergeCompleteLinkage(distances map[uint64]float64, neighbors *neighborLists, kept, removed int32) {
+	neighbors.Clock++
+	neighbors.Updated[kept] = neighbors.Clock
+
+	delete(distances, pairKey(kept, removed))
+	numCurrent := neighbors.Start[kept]
+	for k := neighbors.Start[kept]; k < neighbors.End[kept]; k++ {
+		other := neighbors.IDs[k]
+		keptKey := pairKey(kept, other)
+		distance1, ok := distances[keptKey]
+		if !ok {
+			continue
+		}
+		distance2, ok := distances[pairKey(removed, other)]
+		if !ok {
+			delete(distances, keptKey)
+			continue
+		}
+		distance := max(distance1, distance2)
+		distances[keptKey] = distance
+		neighbors.IDs[numCurrent], neighbors.Distance[numCurrent], neighbors.Stamp[numCurrent] = other, distance, neighbors.Clock
+		numCurrent++
+	}
+	neighbors.End[kept] = numCurrent
+
+	// All distances of the removed cluster are dropped in one pass,
+	// so that each of its keys is probed only once
+	for k := neighbors.Start[removed]; k < neighbors.End[removed]; k++ {
+		delete(distances, pairKey(removed, neighbors.IDs[k]))
+	}
+	neighbors.End[removed] = neighbors.Start[removed]
+}
+
+// neighborLists stores the neighbors of all clusters in a single array (CSR layout):
+// the neighbors of cluster `i` are `IDs[Start[i]:End[i]]`, with their distances in `Distance`
+// Lists only shrink during clustering, so they are filtered in place and never moved
+// A stored distance is up to date unless the neighbor has been merged with another cluster
+// after the entry was written, i.e. if its `Stamp` is older than the `Updated` time of the neighbor
+type neighborLists struct {
+	Start, End []int
+	IDs        []int32
+	Distance   []float64
+	Stamp      []int32 // Time each entry was written
+	Updated    []int32 // Time each cluster was last merged with another cluster
+	Clock      int32   // Number of merges so far
+}
+
+// Build the neighbor lists of `numClusters` clusters from unique pairs of cluster IDs `a[i]`, `b[i]`
+func newNeighborLists(numClusters int, a, b []int32, distance []float64) *neighborLists {
+	neighbors := &neighborLists{
+		Start:    make([]int, numClusters+1),
+		End:      make([]int, numClusters),
+		IDs:      make([]int32, 2*len(a)),
+		Distance: make([]float64, 2*len(a)),
+		Stamp:    make([]int32, 2*len(a)),
+		Updated:  make([]int32, numClusters),
+	}
+
+	// Count the neighbors of each cluster, then turn the counts into offsets
+	for i := range a {
+		neighbors.Start[a[i]+1]++
+		neighbors.Start[b[i]+1]++
+	}
+	for i := 0; i < numClusters; i++ {
+		neighbors.Start[i+1] += neighbors.Start[i]
+	}
+	neighbors.Start = neighbors.Start[:numClusters]
+
+	copy(neighbors.End, neighbors.Start)
+	for i := range a {
+		id1, id2 := a[i], b[i]
+		neighbors.IDs[neighbors.End[id1]], neighbors.Distance[neighbors.End[id1]] = id2, distance[i]
+		neighbors.End[id1]++
+		neighbors.IDs[neighbors.End[id2]], neighbors.Distance[neighbors.End[id2]] = id1, distance[i]
+		neighbors.End[id2]++
+	}
+	return neighbors
+}
+
+// Pack an unordered pair of IDs into a single map key, with the smaller ID in the upper half
+func pairKey(id1, id2 int32) uint64 {
+	if id2 < id1 {
+		id1, id2 = id2, id1
+	}
+	return uint64(id1)<<32 | uint64(id2)
 }
 
 // Write the cluster members and their IDs to the output file, sorted first by cluster ID and then by label
@@ -195,13 +729,19 @@ func exportClusters(outputPath string, clusters []clusterInfo) error {
 		return clusters[i].ClusterID < clusters[j].ClusterID
 	})
 
+	// Buffer the output, instead of one write call per line
+	writer := bufio.NewWriterSize(file, ioBufferSize)
 	for _, cluster := range clusters {
-		if _, err := fmt.Fprintf(file, "%d\t%s\n", cluster.ClusterID, cluster.Label); err != nil {
-			return err
-		}
+		writer.WriteString(strconv.Itoa(cluster.ClusterID))
+		writer.WriteByte('\t')
+		writer.WriteString(cluster.Label)
+		writer.WriteByte('\n')
+	}
+	if err := writer.Flush(); err != nil {
+		return err
 	}
 
-	return nil
+	return file.Close()
 }
 
 func main() {
@@ -210,6 +750,8 @@ func main() {
 	cutoff := flag.Float64("cutoff", 0.0, "Distance cutoff for clustering (must be greater than 0)")
 	includeEqual := flag.Bool("includeequal", true, "Include distances equal to cutoff in clustering (default is true; set it to false for strictly greater than cutoff)")
 	method := flag.String("method", "single", "Clustering method to use ('single' or 'complete')")
+	threads := flag.Int("threads", runtime.NumCPU(), "Number of threads to use")
+	mstCache := flag.String("mstcache", "", "Directory for caching the minimum spanning tree of the input, reused by single linkage runs with any cutoff (optional)")
 
 	// Parse the command-line flags
 	flag.Parse()
@@ -220,15 +762,19 @@ func main() {
 		return
 	}
 
-	// fmt.Printf("Using the %s method for clustering.\n", *method)
+	if *threads > 0 {
+		runtime.GOMAXPROCS(*threads)
+	}
 
 	var clusters []clusterInfo
 	var err error
 
-	if *method == "single" {
+	if *method == "single" && *mstCache != "" {
+		clusters, err = getCachedSingleLinkageClusters(*input, *mstCache, *cutoff, *includeEqual)
+	} else if *method == "single" {
 		clusters, err = getSingleLinkageClusters(*input, *cutoff, *includeEqual)
 	} else {
-		clusters, err = getCompleteLinkageClusters(*input, *cutoff)
+		clusters, err = getCompleteLinkageClusters(*input, *cutoff, *includeEqual)
 	}
 
 	if err != nil {
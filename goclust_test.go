@@ -0,0 +1,472 @@
+package main
+
+import (
+	"fmt"
+	"math"
+	"math/rand"
+	"os"
+	"path/filepath"
+	"slices"
+	"sort"
+	"strconv"
+	"strings"
+	"testing"
+)
+
+// pair is a pairwise distance of the test inputs
+type pair struct {
+	Label1, Label2 string
+	Distance       float64
+}
+
+// Write the pairs to an input file in the tab-separated format
+func writeInput(t *testing.T, pairs []pair) string {
+	t.Helper()
+	var lines strings.Builder
+	for _, p := range pairs {
+		fmt.Fprintf(&lines, "%s\t%s\t%s\n", p.Label1, p.Label2, strconv.FormatFloat(p.Distance, 'g', -1, 64))
+	}
+	path := filepath.Join(t.TempDir(), "input.txt")
+	if err := os.WriteFile(path, []byte(lines.String()), 0o644); err != nil {
+		t.Fatal(err)
+	}
+	return path
+}
+
+// Generate pairs of `n` labels with distinct distances in [0, maxDist),
+// each pair of labels being present with probability `p`
+func randomPairs(rng *rand.Rand, n int, p, maxDist float64) []pair {
+	var pairs []pair
+	for i := 0; i < n; i++ {
+		for j := i + 1; j < n; j++ {
+			if rng.Float64() < p {
+				pairs = append(pairs, pair{Label1: fmt.Sprintf("s%d", i), Label2: fmt.Sprintf("s%d", j)})
+			}
+		}
+	}
+	for k, rank := range rng.Perm(len(pairs)) {
+		pairs[k].Distance = maxDist * float64(rank) / float64(len(pairs))
+		if rng.Intn(2) == 0 {
+			pairs[k].Label1, pairs[k].Label2 = pairs[k].Label2, pairs[k].Label1
+		}
+	}
+	return pairs
+}
+
+// Get the clusters as sorted lists of their labels, ignoring the cluster IDs
+func partition(clusters []clusterInfo) []string {
+	members := make(map[int][]string)
+	for _, cluster := range clusters {
+		members[cluster.ClusterID] = append(members[cluster.ClusterID], cluster.Label)
+	}
+	var groups []string
+	for _, labels := range members {
+		sort.Strings(labels)
+		groups = append(groups, strings.Join(labels, ","))
+	}
+	sort.Strings(groups)
+	return groups
+}
+
+// Naive single linkage: labels of each passing pair are relabeled to the same cluster until nothing changes
+// Only the labels with a passing pair are reported
+func naiveSingleLinkage(pairs []pair, cutOff float64, includeEqual bool) []string {
+	cluster := make(map[string]string)
+	for _, p := range pairs {
+		if withinCutoff(p.Distance, cutOff, includeEqual) {
+			cluster[p.Label1], cluster[p.Label2] = p.Label1, p.Label2
+		}
+	}
+	for changed := true; changed; {
+		changed = false
+		for _, p := range pairs {
+			if !withinCutoff(p.Distance, cutOff, includeEqual) || cluster[p.Label1] == cluster[p.Label2] {
+				continue
+			}
+			from, to := max(cluster[p.Label1], cluster[p.Label2]), min(cluster[p.Label1], cluster[p.Label2])
+			for label, id := range cluster {
+				if id == from {
+					cluster[label] = to
+				}
+			}
+			changed = true
+		}
+	}
+	return groupLabels(cluster)
+}
+
+// Get the labels of the test input in order of their first appearance
+func labelsOf(pairs []pair) []string {
+	var labels []string
+	seen := make(map[string]bool)
+	for _, p := range pairs {
+		for _, label := range []string{p.Label1, p.Label2} {
+			if !seen[label] {
+				seen[label] = true
+				labels = append(labels, label)
+			}
+		}
+	}
+	return labels
+}
+
+// Get the distance between two labels of the test input, with missing pairs at `maxDistance`
+func pairDistances(pairs []pair) func(label1, label2 string) float64 {
+	distances := make(map[[2]string]float64)
+	for _, p := range pairs {
+		distances[[2]string{p.Label1, p.Label2}] = p.Distance
+		distances[[2]string{p.Label2, p.Label1}] = p.Distance
+	}
+	return func(label1, label2 string) float64 {
+		if distance, ok := distances[[2]string{label1, label2}]; ok {
+			return distance
+		}
+		return maxDistance
+	}
+}
+
+// Get the complete linkage distance between two clusters: the largest distance between their members
+func clusterDistance(members1, members2 []string, distance func(label1, label2 string) float64) float64 {
+	d := math.Inf(-1)
+	for _, label1 := range members1 {
+		for _, label2 := range members2 {
+			if label1 != label2 {
+				d = max(d, distance(label1, label2))
+			}
+		}
+	}
+	return d
+}
+
+// Naive complete linkage: the globally closest pair of clusters is merged while it passes the cutoff,
+// with missing pairs at `maxDistance` and the cluster distances recomputed from all member pairs
+func naiveCompleteLinkage(pairs []pair, cutOff float64, includeEqual bool) []string {
+	distance := pairDistances(pairs)
+	var clusters [][]string
+	for _, label := range labelsOf(pairs) {
+		clusters = append(clusters, []string{label})
+	}
+
+	for {
+		best, bestDist := [2]int{-1, -1}, math.Inf(1)
+		for i := range clusters {
+			for j := i + 1; j < len(clusters); j++ {
+				d := clusterDistance(clusters[i], clusters[j], distance)
+				if withinCutoff(d, cutOff, includeEqual) && d < bestDist {
+					best, bestDist = [2]int{i, j}, d
+				}
+			}
+		}
+		if best[0] < 0 {
+			break
+		}
+		clusters[best[0]] = append(clusters[best[0]], clusters[best[1]]...)
+		clusters = slices.Delete(clusters, best[1], best[1]+1)
+	}
+
+	cluster := make(map[string]string)
+	for _, members := range clusters {
+		for _, label := range members {
+			cluster[label] = members[0]
+		}
+	}
+	return groupLabels(cluster)
+}
+
+// Get the clusters of a label-to-cluster map as sorted lists of their labels
+func groupLabels(cluster map[string]string) []string {
+	members := make(map[string][]string)
+	for label, id := range cluster {
+		members[id] = append(members[id], label)
+	}
+	groups := make([]string, 0, len(members))
+	for _, labels := range members {
+		sort.Strings(labels)
+		groups = append(groups, strings.Join(labels, ","))
+	}
+	sort.Strings(groups)
+	return groups
+}
+
+// Test inputs: random ones with distinct distances, and the edge cases of the distance handling
+type clusteringCase struct {
+	Name         string
+	Pairs        []pair
+	CutOffs      []float64
+	IncludeEqual bool
+}
+
+func clusteringCases() []clusteringCase {
+	var cases []clusteringCase
+	rng := rand.New(rand.NewSource(1))
+	for i := 0; i < 40; i++ {
+		n := 2 + rng.Intn(30)
+		p := []float64{0.1, 0.3, 0.8}[i%3]
+		pairs := randomPairs(rng, n, p, 1)
+		cutOffs := []float64{0.05, 0.2, 0.5}
+		if len(pairs) > 0 {
+			cutOffs = append(cutOffs, pairs[rng.Intn(len(pairs))].Distance)
+		}
+		cases = append(cases, clusteringCase{Name: fmt.Sprintf("random %d", i), Pairs: pairs, CutOffs: cutOffs, IncludeEqual: i%2 == 0})
+	}
+	// Complete inputs, so that clusters at the maximum distance are not tied
+	for i := 0; i < 10; i++ {
+		pairs := randomPairs(rng, 2+rng.Intn(15), 1, 2)
+		cases = append(cases, clusteringCase{Name: fmt.Sprintf("random complete %d", i), Pairs: pairs, CutOffs: []float64{1.0, 1.3, 1.7}, IncludeEqual: i%2 == 0})
+	}
+	cases = append(cases, clusteringCase{
+		Name:    "distances above the maximum distance",
+		Pairs:   []pair{{"a", "b", 0.5}, {"a", "c", 2}, {"b", "c", 0.5}},
+		CutOffs: []float64{0.4, 0.5, 1.0, 1.5, 2},
+	})
+	cases = append(cases, clusteringCase{
+		Name:         "distances at the float32 boundary",
+		Pairs:        []pair{{"a", "b", 0.30000001}, {"c", "d", 0.1}, {"b", "c", 0.29999999}, {"e", "f", 0.3}},
+		CutOffs:      []float64{0.3, 0.30000001},
+		IncludeEqual: true,
+	})
+	cases = append(cases, clusteringCase{
+		Name:    "negative and infinite distances",
+		Pairs:   []pair{{"a", "b", -5}, {"c", "d", math.Inf(1)}, {"e", "f", 0.2}, {"g", "h", math.Inf(-1)}, {"a", "e", 0.7}},
+		CutOffs: []float64{0.1, 0.5, 0.7, math.Inf(1)},
+	})
+	cases = append(cases, clusteringCase{
+		Name:         "distances one ulp apart",
+		Pairs:        []pair{{"a", "b", 0}, {"c", "d", math.SmallestNonzeroFloat64}},
+		CutOffs:      []float64{0, math.SmallestNonzeroFloat64, 0.5},
+		IncludeEqual: true,
+	})
+	return cases
+}
+
+func TestSingleLinkage(t *testing.T) {
+	for _, tc := range clusteringCases() {
+		t.Run(tc.Name, func(t *testing.T) {
+			input := writeInput(t, tc.Pairs)
+			cacheDir := t.TempDir()
+			for _, cutOff := range tc.CutOffs {
+				want := naiveSingleLinkage(tc.Pairs, cutOff, tc.IncludeEqual)
+
+				clusters, err := getSingleLinkageClusters(input, cutOff, tc.IncludeEqual)
+				if err != nil {
+					t.Fatal(err)
+				}
+				if got := partition(clusters); !slices.Equal(got, want) {
+					t.Errorf("cutoff %v: got %v, want %v", cutOff, got, want)
+				}
+
+				// The first cutoff builds the cached spanning forest, the others load it
+				clusters, err = getCachedSingleLinkageClusters(input, cacheDir, cutOff, tc.IncludeEqual)
+				if err != nil {
+					t.Fatal(err)
+				}
+				if got := partition(clusters); !slices.Equal(got, want) {
+					t.Errorf("cutoff %v with cache: got %v, want %v", cutOff, got, want)
+				}
+			}
+		})
+	}
+}
+
+// Single linkage merges the pairs in batches while reading, and the spanning forest for the cache
+// is reduced several times while reading, so check an input of several batches,
+// against connected components found by a breadth-first search
+func TestSingleLinkageBatches(t *testing.T) {
+	rng := rand.New(rand.NewSource(8))
+	numLabels := edgeBatchSize
+	var pairs []pair
+	neighbors := make(map[string][]string)
+	for i := 0; i < 2*spanningForestReduceMinEdges+100; i++ {
+		p := pair{fmt.Sprintf("s%d", rng.Intn(numLabels)), fmt.Sprintf("s%d", rng.Intn(numLabels)), rng.Float64()}
+		pairs = append(pairs, p)
+		if withinCutoff(p.Distance, 0.05, true) {
+			neighbors[p.Label1] = append(neighbors[p.Label1], p.Label2)
+			neighbors[p.Label2] = append(neighbors[p.Label2], p.Label1)
+		}
+	}
+
+	cluster := make(map[string]string)
+	for label := range neighbors {
+		if _, ok := cluster[label]; ok {
+			continue
+		}
+		cluster[label] = label
+		for queue := []string{label}; len(queue) > 0; queue = queue[1:] {
+			for _, neighbor := range neighbors[queue[0]] {
+				if _, ok := cluster[neighbor]; !ok {
+					cluster[neighbor] = label
+					queue = append(queue, neighbor)
+				}
+			}
+		}
+	}
+
+	input := writeInput(t, pairs)
+	want := groupLabels(cluster)
+	clusters, err := getSingleLinkageClusters(input, 0.05, true)
+	if err != nil {
+		t.Fatal(err)
+	}
+	if got := partition(clusters); !slices.Equal(got, want) {
+		t.Errorf("got %d clusters, want %d", len(got), len(want))
+	}
+	clusters, err = getCachedSingleLinkageClusters(input, t.TempDir(), 0.05, true)
+	if err != nil {
+		t.Fatal(err)
+	}
+	if got := partition(clusters); !slices.Equal(got, want) {
+		t.Errorf("with cache: got %d clusters, want %d", len(got), len(want))
+	}
+}
+
+func TestCompleteLinkage(t *testing.T) {
+	for _, tc := range clusteringCases() {
+		t.Run(tc.Name, func(t *testing.T) {
+			input := writeInput(t, tc.Pairs)
+			for _, cutOff := range tc.CutOffs {
+				clusters, err := getCompleteLinkageClusters(input, cutOff, tc.IncludeEqual)
+				if err != nil {
+					t.Fatal(err)
+				}
+				want := naiveCompleteLinkage(tc.Pairs, cutOff, tc.IncludeEqual)
+				if got := partition(clusters); !slices.Equal(got, want) {
+					t.Errorf("cutoff %v: got %v, want %v", cutOff, got, want)
+				}
+			}
+		})
+	}
+}
+
+// With missing pairs passing the cutoff, clusters at `maxDistance` are tied, and the result depends
+// on the order of their merges, so it is checked for the properties of any complete linkage result:
+// the diameter of every cluster passes the cutoff, and no two clusters could still be merged
+func TestCompleteLinkageAboveMaxDistance(t *testing.T) {
+	rng := rand.New(rand.NewSource(6))
+	for i := 0; i < 100; i++ {
+		pairs := randomPairs(rng, 2+rng.Intn(40), []float64{0.1, 0.3, 0.6}[i%3], 2)
+		input := writeInput(t, pairs)
+		distance := pairDistances(pairs)
+		includeEqual := i%2 == 0
+		for _, cutOff := range []float64{1.0, 1.2, 1.5} {
+			clusters, err := getCompleteLinkageClusters(input, cutOff, includeEqual)
+			if err != nil {
+				t.Fatal(err)
+			}
+			if len(clusters) != len(labelsOf(pairs)) {
+				t.Errorf("input %d, cutoff %v: got %d labels, want %d", i, cutOff, len(clusters), len(labelsOf(pairs)))
+			}
+
+			members := make(map[int][]string)
+			for _, cluster := range clusters {
+				members[cluster.ClusterID] = append(members[cluster.ClusterID], cluster.Label)
+			}
+			for id1, members1 := range members {
+				if d := clusterDistance(members1, members1, distance); !withinCutoff(d, cutOff, includeEqual) {
+					t.Errorf("input %d, cutoff %v: cluster %v has diameter %v", i, cutOff, members1, d)
+				}
+				for id2, members2 := range members {
+					if d := clusterDistance(members1, members2, distance); id1 < id2 && withinCutoff(d, cutOff, includeEqual) {
+						t.Errorf("input %d, cutoff %v: clusters %v and %v at %v are not merged", i, cutOff, members1, members2, d)
+					}
+				}
+			}
+		}
+	}
+}
+
+// Benchmark the union-find kernel on random pairs of a million labels,
+// so that the forest does not fit in the CPU caches
+func BenchmarkSlinkCore(b *testing.B) {
+	rng := rand.New(rand.NewSource(7))
+	numLabels := 1 << 20
+	ids1, ids2 := make([]int32, 2*numLabels), make([]int32, 2*numLabels)
+	for i := range ids1 {
+		ids1[i], ids2[i] = int32(rng.Intn(numLabels)), int32(rng.Intn(numLabels))
+	}
+
+	for i := 0; i < b.N; i++ {
+		b.StopTimer()
+		parent, rank := newDisjointSets(numLabels), make([]uint8, numLabels)
+		b.StartTimer()
+		slinkCore(ids1, ids2, parent, rank)
+	}
+}
+
+func TestSortEdges(t *testing.T) {
+	rng := rand.New(rand.NewSource(3))
+	special := []float64{math.Inf(1), math.Inf(-1), 0, math.Copysign(0, -1), -1e308, 1e308, math.SmallestNonzeroFloat64}
+	for _, numEdges := range []int{100, radixSortMinEdges * 2} {
+		edges := make([]forestEdge, numEdges)
+		for i := range edges {
+			edges[i].Distance = rng.NormFloat64()
+			if i < len(special) {
+				edges[i].Distance = special[i]
+			}
+		}
+		sortEdges(edges)
+		if !slices.IsSortedFunc(edges, func(edge1, edge2 forestEdge) int {
+			if edge1.Distance < edge2.Distance {
+				return -1
+			}
+			if edge1.Distance > edge2.Distance {
+				return 1
+			}
+			return 0
+		}) {
+			t.Errorf("%d edges are not sorted", numEdges)
+		}
+	}
+}
+
+func TestSplitLine(t *testing.T) {
+	lines := []string{
+		"a\tb\t0.5",
+		"a\tb\t0.5\n",
+		"a\tb\t0.5\r",
+		"a b 0.5",
+		"a b 0.5\tx\ty",
+		"a\tb c\t0.5",
+		" a\tb\t0.5",
+		"a\t b\t0.5",
+		"a\tb\t 0.5 x",
+		"a\t\tb\t0.5",
+		"a\tb",
+		"",
+	}
+	rng := rand.New(rand.NewSource(4))
+	for i := 0; i < 1000; i++ {
+		var line []byte
+		for j := 0; j < rng.Intn(12); j++ {
+			line = append(line, "ab \t\r"[rng.Intn(5)])
+		}
+		lines = append(lines, string(line))
+	}
+
+	for _, line := range lines {
+		label1, label2, distance, ok := splitLine([]byte(line))
+		fields := strings.Fields(line)
+		if ok != (len(fields) >= 3) {
+			t.Errorf("%q: got ok = %v for %d fields", line, ok, len(fields))
+			continue
+		}
+		if ok && (string(label1) != fields[0] || string(label2) != fields[1] || string(distance) != fields[2]) {
+			t.Errorf("%q: got %q %q %q, want %q", line, label1, label2, distance, fields[:3])
+		}
+	}
+}
+
+func TestParseDistance(t *testing.T) {
+	fields := []string{"0", "1", "0.5", "0.30000001", "123.456", ".5", "5.", "1e-3", "-0.5", "+1", "inf", "NaN", "0.1234567890123456789", "", ".", "1.2.3", "x"}
+	rng := rand.New(rand.NewSource(5))
+	for i := 0; i < 100000; i++ {
+		fields = append(fields, strconv.FormatFloat(rng.Float64()*math.Pow(10, float64(rng.Intn(8)-4)), 'f', rng.Intn(18), 64))
+	}
+
+	for _, field := range fields {
+		got, gotErr := parseDistance([]byte(field))
+		want, wantErr := strconv.ParseFloat(field, 64)
+		if (gotErr != nil) != (wantErr != nil) || math.Float64bits(got) != math.Float64bits(want) {
+			t.Errorf("%q: got %v (%v), want %v (%v)", field, got, gotErr, want, wantErr)
+		}
+	}
+}
@@ -0,0 +1,353 @@
+package main
+
+import (
+	"cmp"
+	"crypto/sha256"
+	"encoding/gob"
+	"encoding/hex"
+	"fmt"
+	"math"
+	"os"
+	"path/filepath"
+	"runtime"
+	"slices"
+	"sync"
+)
+
+// Single linkage clusters at any cutoff are the connected components of the
+// minimum spanning forest of the distance graph, after removing the edges above the cutoff
+// The forest is built once per input file (Kruskal's algorithm) and cached on disk,
+// so that runs with other cutoffs do not need to read the input again
+
+// Number of distance bands used when building the spanning forest
+const spanningForestBands = 16
+
+// Minimum number of edges for using radix sort instead of a comparison sort
+const radixSortMinEdges = 1 << 16
+
+// Minimum number of collected pairs before reducing them to their spanning forest
+// (they are reduced once they are also twice the number of labels)
+const spanningForestReduceMinEdges = 8 * edgeBatchSize
+
+// Minimum number of edges for splitting work between goroutines
+const parallelMinEdges = 1 << 16
+
+// Version of the cache file format, part of the cache key so that files in an older format are not loaded
+// (version 2 stores the distances as float64 instead of float32)
+const spanningForestCacheVersion = 2
+
+// forestEdge is a candidate edge of the spanning forest
+type forestEdge struct {
+	A, B     int32
+	Distance float64
+}
+
+// spanningForest holds the minimum spanning forest of all pairwise distances in the input
+type spanningForest struct {
+	Labels      []string  // Label of each ID
+	MinDistance []float64 // Smallest distance of each label to any label (including itself)
+	A, B        []int32   // IDs of the two labels in each edge of the forest
+	Distance    []float64 // Distance of each edge of the forest
+}
+
+// Single linkage clustering using a cached minimum spanning forest of the input
+func getCachedSingleLinkageClusters(inputPath, cacheDir string, cutOff float64, includeEqual bool) ([]clusterInfo, error) {
+	cachePath, err := spanningForestCachePath(inputPath, cacheDir)
+	if err != nil {
+		return nil, err
+	}
+
+	forest, err := loadSpanningForest(cachePath)
+	if err != nil {
+		forest, err = buildSpanningForest(inputPath)
+		if err != nil {
+			return nil, err
+		}
+		if err := saveSpanningForest(cachePath, forest); err != nil {
+			return nil, err
+		}
+	}
+
+	return cutSpanningForest(forest, cutOff, includeEqual), nil
+}
+
+// Build the minimum spanning forest of all pairwise distances in the input file
+// Pairs are collected while reading, and reduced to the spanning forest of the pairs collected so far
+// whenever they reach twice the number of labels: an edge left out of the forest of some of the pairs
+// closes a cycle of shorter edges, so it is never needed in the forest of all of them
+func buildSpanningForest(inputPath string) (*spanningForest, error) {
+	var minDistance []float64
+	var candidates []forestEdge
+	edges, err := readEdges(inputPath, math.Inf(1), true, false, func(edges *edgeList) {
+		for id := len(minDistance); id < len(edges.Labels); id++ {
+			minDistance = append(minDistance, math.Inf(1))
+		}
+		for i, distance := range edges.Distance {
+			id1, id2 := edges.A[i], edges.B[i]
+			minDistance[id1] = min(minDistance[id1], distance)
+			minDistance[id2] = min(minDistance[id2], distance)
+			// Self-pairs never join two different trees
+			if id1 != id2 {
+				candidates = append(candidates, forestEdge{A: id1, B: id2, Distance: distance})
+			}
+		}
+		if len(candidates) >= max(spanningForestReduceMinEdges, 2*len(edges.Labels)) {
+			candidates = reduceToSpanningForest(len(edges.Labels), candidates)
+		}
+	})
+	if err != nil {
+		return nil, err
+	}
+	candidates = reduceToSpanningForest(len(edges.Labels), candidates)
+
+	forest := &spanningForest{
+		Labels:      edges.Labels,
+		MinDistance: minDistance,
+		A:           make([]int32, len(candidates)),
+		B:           make([]int32, len(candidates)),
+		Distance:    make([]float64, len(candidates)),
+	}
+	for i, edge := range candidates {
+		forest.A[i], forest.B[i], forest.Distance[i] = edge.A, edge.B, edge.Distance
+	}
+	return forest, nil
+}
+
+// Reduce the edges to their minimum spanning forest with Kruskal's algorithm, in place:
+// edges are visited in order of increasing distance and kept if they join two different trees
+// Duplicate pairs are not removed beforehand, they are skipped like any other edge within a tree
+func reduceToSpanningForest(numLabels int, edges []forestEdge) []forestEdge {
+	// Edges are processed in bands of increasing distance. Once a band is done,
+	// the edges of later bands that join labels of the same tree are dropped before sorting,
+	// so on well-connected inputs most long edges are never sorted
+	// Kept edges are moved to the front; there are never more of them than edges already visited
+	parent, rank := newDisjointSets(numLabels), make([]uint8, numLabels)
+	n := 0
+	for band, bandEdges := range splitDistanceBands(edges, spanningForestBands) {
+		// A spanning tree of all labels has `numLabels - 1` edges, so no later edge can be kept
+		if n == numLabels-1 {
+			break
+		}
+		if band > 0 {
+			bandEdges = dropConnectedEdges(parent, bandEdges)
+		}
+		sortEdges(bandEdges)
+		for _, edge := range bandEdges {
+			if n == numLabels-1 {
+				break
+			}
+			if union(parent, rank, edge.A, edge.B) {
+				edges[n] = edge
+				n++
+			}
+		}
+	}
+	return edges[:n]
+}
+
+// Split the edges into bands of equal distance range, in place (bucket sort)
+// Every edge of a band is shorter than every edge of the following bands
+// The range spans the finite distances; infinite ones go to the first or the last band
+func splitDistanceBands(edges []forestEdge, numBands int) [][]forestEdge {
+	shortest, longest := math.Inf(1), math.Inf(-1)
+	for _, edge := range edges {
+		if !math.IsInf(edge.Distance, 0) {
+			shortest, longest = min(shortest, edge.Distance), max(longest, edge.Distance)
+		}
+	}
+	// Halved so that the differences can not overflow; this can make the span zero for subnormal distances,
+	// and it is negative without any finite distance
+	span := longest/2 - shortest/2
+	bandOf := func(distance float64) int {
+		if !(span > 0) {
+			return 0
+		}
+		position := (distance/2 - shortest/2) / span * float64(numBands)
+		return int(min(max(position, 0), float64(numBands-1)))
+	}
+
+	// Count the edges of each band, then swap every edge into the next free slot of its band
+	offsets := make([]int, numBands+1)
+	for _, edge := range edges {
+		offsets[bandOf(edge.Distance)+1]++
+	}
+	for band := 0; band < numBands; band++ {
+		offsets[band+1] += offsets[band]
+	}
+	next := slices.Clone(offsets[:numBands])
+	for band := 0; band < numBands; band++ {
+		for next[band] < offsets[band+1] {
+			target := bandOf(edges[next[band]].Distance)
+			if target == band {
+				next[band]++
+				continue
+			}
+			edges[next[band]], edges[next[target]] = edges[next[target]], edges[next[band]]
+			next[target]++
+		}
+	}
+
+	bands := make([][]forestEdge, numBands)
+	for band := range bands {
+		bands[band] = edges[offsets[band]:offsets[band+1]]
+	}
+	return bands
+}
+
+// Sort the edges by distance
+// Large lists are radix sorted in linear time, small ones with a comparison sort
+func sortEdges(edges []forestEdge) {
+	if len(edges) < radixSortMinEdges {
+		slices.SortFunc(edges, func(edge1, edge2 forestEdge) int {
+			return cmp.Compare(edge1.Distance, edge2.Distance)
+		})
+		return
+	}
+
+	// Least-significant-digit radix sort on the bits of the distances, in four passes of 16 bits
+	// Distances are not quantized to fewer bits, as this could change which of them pass the cutoff
+	buffer := make([]forestEdge, len(edges))
+	counts := make([]int, 1<<16)
+	src, dst := edges, buffer
+	for shift := 0; shift < 64; shift += 16 {
+		clear(counts)
+		for _, edge := range src {
+			counts[distanceSortKey(edge.Distance)>>shift&0xffff]++
+		}
+		if counts[distanceSortKey(src[0].Distance)>>shift&0xffff] == len(src) {
+			continue // All edges have the same digit
+		}
+		offset := 0
+		for digit, count := range counts {
+			counts[digit] = offset
+			offset += count
+		}
+		for _, edge := range src {
+			digit := distanceSortKey(edge.Distance) >> shift & 0xffff
+			dst[counts[digit]] = edge
+			counts[digit]++
+		}
+		src, dst = dst, src
+	}
+	if &src[0] != &edges[0] {
+		copy(edges, src)
+	}
+}
+
+// Map a distance to an unsigned integer with the same order
+// Non-negative floats are ordered as their bits; negative ones have their order reversed
+func distanceSortKey(distance float64) uint64 {
+	bits := math.Float64bits(distance)
+	if bits>>63 == 1 {
+		return ^bits
+	}
+	return bits | 1<<63
+}
+
+// Remove the edges that join two labels of the same tree, in place
+// The forest is flattened first (every label points directly to its root),
+// so the edges can be checked by several goroutines that only read `parent`
+func dropConnectedEdges(parent []int32, edges []forestEdge) []forestEdge {
+	for i := range parent {
+		parent[i] = find(parent, int32(i))
+	}
+
+	keep := make([]bool, len(edges))
+	numWorkers := runtime.GOMAXPROCS(0)
+	if len(edges) < parallelMinEdges {
+		numWorkers = 1
+	}
+	chunkSize := (len(edges) + numWorkers - 1) / numWorkers
+	var wg sync.WaitGroup
+	for start := 0; start < len(edges); start += chunkSize {
+		end := min(start+chunkSize, len(edges))
+		wg.Add(1)
+		go func(chunk []forestEdge, keep []bool) {
+			defer wg.Done()
+			for i, edge := range chunk {
+				keep[i] = parent[edge.A] != parent[edge.B]
+			}
+		}(edges[start:end], keep[start:end])
+	}
+	wg.Wait()
+
+	n := 0
+	for i, edge := range edges {
+		if keep[i] {
+			edges[n] = edge
+			n++
+		}
+	}
+	return edges[:n]
+}
+
+// Get the single linkage clusters at the cutoff from the minimum spanning forest
+// Labels without any distance that passes the cutoff are not reported,
+// the same as when clustering the input directly
+func cutSpanningForest(forest *spanningForest, cutOff float64, includeEqual bool) []clusterInfo {
+	parent, rank := newDisjointSets(len(forest.Labels)), make([]uint8, len(forest.Labels))
+	for i, distance := range forest.Distance {
+		if withinCutoff(distance, cutOff, includeEqual) {
+			union(parent, rank, forest.A[i], forest.B[i])
+		}
+	}
+
+	keep := make([]bool, len(forest.Labels))
+	for id, distance := range forest.MinDistance {
+		keep[id] = withinCutoff(distance, cutOff, includeEqual)
+	}
+	return assignClusterIDs(forest.Labels, parent, keep)
+}
+
+// Get the path of the cached spanning forest for the input file
+// The cache is keyed by the absolute path, size, and modification time of the input,
+// so it is invalidated when the file changes without having to read it, and by the cache format version
+func spanningForestCachePath(inputPath, cacheDir string) (string, error) {
+	absPath, err := filepath.Abs(inputPath)
+	if err != nil {
+		return "", err
+	}
+	info, err := os.Stat(absPath)
+	if err != nil {
+		return "", err
+	}
+	key := sha256.Sum256([]byte(fmt.Sprintf("%d\x00%s\x00%d\x00%d", spanningForestCacheVersion, absPath, info.Size(), info.ModTime().UnixNano())))
+	return filepath.Join(cacheDir, hex.EncodeToString(key[:])+".mst"), nil
+}
+
+// Load a cached spanning forest
+func loadSpanningForest(cachePath string) (*spanningForest, error) {
+	file, err := os.Open(cachePath)
+	if err != nil {
+		return nil, err
+	}
+	defer file.Close()
+
+	forest := &spanningForest{}
+	if err := gob.NewDecoder(file).Decode(forest); err != nil {
+		return nil, err
+	}
+	return forest, nil
+}
+
+// Save a spanning forest to the cache
+// The forest is written to a temporary file first, so that an interrupted run does not leave a partial cache file
+func saveSpanningForest(cachePath string, forest *spanningForest) error {
+	if err := os.MkdirAll(filepath.Dir(cachePath), 0o755); err != nil {
+		return err
+	}
+	file, err := os.CreateTemp(filepath.Dir(cachePath), ".mst-*")
+	if err != nil {
+		return err
+	}
+	defer os.Remove(file.Name())
+
+	if err := gob.NewEncoder(file).Encode(forest); err != nil {
+		file.Close()
+		return err
+	}
+	if err := file.Close(); err != nil {
+		return err
+	}
+	return os.Rename(file.Name(), cachePath)
+}